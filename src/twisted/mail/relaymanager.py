@@ -352,7 +352,7 @@ class Queue:
         @rtype: L{list} of L{bytes}
         @return: The base filenames of messages waiting to be relayed.
         """
-        return self.waiting.keys()
+        return list(self.waiting)
 
     def hasWaiting(self):
         """
@@ -373,7 +373,7 @@ class Queue:
         @return: The base filenames of messages in the process of being
             relayed.
         """
-        return self.relayed.keys()
+        return list(self.relayed)
 
     def setRelaying(self, message):
         """
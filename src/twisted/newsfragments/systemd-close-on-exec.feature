@@ -0,0 +1 @@
+twisted.python.systemd.ListenFDs.fromEnvironment, which runs when twisted.internet.endpoints is imported, now marks the descriptors inherited from systemd as close-on-exec and removes LISTEN_FDNAMES from the environment along with LISTEN_PID and LISTEN_FDS, as sd_listen_fds(3) does.  Processes which pass these descriptors on to a child process must now make them inheritable again, for example with os.set_inheritable.
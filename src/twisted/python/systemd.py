@@ -12,8 +12,38 @@ feature are supported.
 
 __all__ = ["ListenFDs"]
 
-from os import getpid
-from typing import Iterable, List, Mapping, Optional
+import os
+from os import getpid, set_inheritable
+from typing import MutableMapping, Optional, Sequence
+
+# The largest LISTEN_FDS value which will be believed.  Anything bigger is far
+# beyond what a service is ever handed and is treated as malformed, so that a
+# bogus value cannot make us walk billions of descriptors.
+_MAX_LISTEN_FDS = 1024
+
+# LISTEN_PID names the process systemd started, so the only PID it is ever
+# compared against is our own.  Look that up once rather than on every call,
+# refreshing it in forked children so they do not claim their parent's
+# descriptors.
+_ownPID = getpid()
+
+
+def _refreshPID() -> None:
+    """
+    Update the cached PID of this process.  This runs in the child after every
+    C{os.fork}.
+    """
+    global _ownPID
+    _ownPID = getpid()
+
+
+try:
+    from os import register_at_fork
+except ImportError:
+    # Platforms without fork() have nothing to refresh.
+    pass
+else:
+    register_at_fork(after_in_child=_refreshPID)
 
 
 class ListenFDs:
@@ -28,23 +58,37 @@ class ListenFDs:
         gives the default starting descriptor.  Since this must agree with the
         value systemd is using, it typically should not be overridden.
 
-    @ivar _descriptors: A C{list} of C{int} giving the descriptors which were
-        inherited.
+    @ivar _descriptors: An immutable sequence (a C{range} or a C{tuple}) of
+        C{int} giving the descriptors which were inherited.
     """
 
+    __slots__ = ("_descriptors",)
+
     _START = 3
 
-    def __init__(self, descriptors: List[int]) -> None:
+    def __init__(self, descriptors: Sequence[int]) -> None:
         """
         @param descriptors: The descriptors which will be returned from calls to
             C{inheritedDescriptors}.
         """
+        if not isinstance(descriptors, (range, tuple)):
+            descriptors = tuple(descriptors)
         self._descriptors = descriptors
 
+    @classmethod
+    def _empty(cls) -> "ListenFDs":
+        """
+        @return: An instance of C{cls} with no descriptors.  Instances are
+            immutable, so L{ListenFDs} itself shares a single one.
+        """
+        if cls is ListenFDs:
+            return _NO_DESCRIPTORS
+        return cls(())
+
     @classmethod
     def fromEnvironment(
         cls,
-        environ: Optional[Mapping[str, str]] = None,
+        environ: Optional[MutableMapping[str, str]] = None,
         start: Optional[int] = None,
     ) -> "ListenFDs":
         """
@@ -58,36 +102,69 @@ class ListenFDs:
             the known correct (that is, in agreement with systemd) value will be
             used.  The default is suitable for typical usage.
 
-        @return: A new instance of C{cls} which can be used to look up the
-            descriptors which have been inherited.
+        @return: An instance of C{cls} which can be used to look up the
+            descriptors which have been inherited.  When nothing was
+            inherited, L{ListenFDs} itself returns a single shared empty
+            instance rather than a new one.
+
+        @note: The result is deliberately not memoized.  A successful call
+            removes the systemd variables from C{environ}, so later calls
+            already take the cheap path and report no descriptors rather than
+            handing the same descriptors out a second time.
         """
         if environ is None:
-            from os import environ as _environ
-
-            environ = _environ
+            # Look this up at call time, not import time, so that replacing
+            # os.environ (as tests do) is respected.
+            environ = os.environ
         if start is None:
             start = cls._START
 
-        descriptors: List[int] = []
-
+        # Outside of systemd socket activation neither variable is set.  Check
+        # for that common case before doing any parsing.
+        rawPID = environ.get("LISTEN_PID")
+        if rawPID is None:
+            return cls._empty()
         try:
-            pid = int(environ["LISTEN_PID"])
-        except (KeyError, ValueError):
-            pass
-        else:
-            if pid == getpid():
-                try:
-                    count = int(environ["LISTEN_FDS"])
-                except (KeyError, ValueError):
-                    pass
-                else:
-                    descriptors = list(range(start, start + count))
-                    del environ["LISTEN_PID"], environ["LISTEN_FDS"]
-
+            pid = int(rawPID)
+        except ValueError:
+            return cls._empty()
+        if pid != _ownPID:
+            return cls._empty()
+
+        rawCount = environ.get("LISTEN_FDS")
+        if rawCount is None:
+            return cls._empty()
+        try:
+            count = int(rawCount)
+        except ValueError:
+            return cls._empty()
+        if not 0 <= count <= _MAX_LISTEN_FDS:
+            return cls._empty()
+
+        descriptors = range(start, start + count)
+        # systemd hands the descriptors over without FD_CLOEXEC.  Set it once
+        # here, as sd_listen_fds(3) does, so they do not leak into every
+        # process we spawn.
+        for fd in descriptors:
+            try:
+                set_inheritable(fd, False)
+            except OSError:
+                pass
+        # Like sd_listen_fds(3) with unset_environment set, clear every
+        # variable describing the inherited descriptors so that nothing else
+        # (including child processes) tries to claim them again.
+        for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+            environ.pop(name, None)
+        if not count:
+            return cls._empty()
         return cls(descriptors)
 
-    def inheritedDescriptors(self) -> Iterable[int]:
+    def inheritedDescriptors(self) -> Sequence[int]:
         """
-        @return: The configured descriptors.
+        @return: The configured descriptors.  This is the same immutable
+            sequence on every call, so no copy is made.
         """
-        return list(self._descriptors)
+        return self._descriptors
+
+
+_NO_DESCRIPTORS = ListenFDs(())
@@ -6,8 +6,11 @@ Tests for L{twisted.python.systemd}.
 """
 
 
+import errno
 import os
+from unittest import skipIf
 
+from twisted.python import systemd
 from twisted.python.systemd import ListenFDs
 from twisted.trial.unittest import TestCase
 
@@ -21,15 +24,16 @@ class InheritedDescriptorsMixin:
 
     def test_inheritedDescriptors(self):
         """
-        C{inheritedDescriptors} returns a list of integers giving the file
+        C{inheritedDescriptors} returns a sequence of integers giving the file
         descriptors which were inherited from systemd.
         """
         sddaemon = self.getDaemon(7, 3)
-        self.assertEqual([7, 8, 9], sddaemon.inheritedDescriptors())
+        self.assertEqual([7, 8, 9], list(sddaemon.inheritedDescriptors()))
 
     def test_repeated(self):
         """
-        Any subsequent calls to C{inheritedDescriptors} return the same list.
+        Any subsequent calls to C{inheritedDescriptors} return the same
+        sequence.
         """
         sddaemon = self.getDaemon(7, 3)
         self.assertEqual(
@@ -61,8 +65,27 @@ class EnvironmentMixin:
     systemd.  To facilitate testing, this mixin will also create a fake
     environment dictionary and add keys to it to make it look as if some
     descriptors have been inherited.
+
+    @ivar madeNonInheritable: The descriptors which
+        L{ListenFDs.fromEnvironment} tried to make non-inheritable.
     """
 
+    def setUp(self):
+        """
+        Record, rather than apply, the close-on-exec changes made by
+        L{ListenFDs.fromEnvironment}.  The descriptor numbers these tests
+        invent may be open in the test runner itself (for example, the
+        channel a C{trial -j} worker uses to talk to its parent), and they
+        must not be modified.
+        """
+        self.madeNonInheritable = []
+
+        def setInheritable(fd, inheritable):
+            self.assertFalse(inheritable)
+            self.madeNonInheritable.append(fd)
+
+        self.patch(systemd, "set_inheritable", setInheritable)
+
     def initializeEnvironment(self, count, pid):
         """
         Create a copy of the process environment and add I{LISTEN_FDS} and
@@ -90,6 +113,25 @@ class MemoryOnlyTests(MemoryOnlyMixin, InheritedDescriptorsMixin, TestCase):
     descriptors.
     """
 
+    def test_copiesDescriptors(self):
+        """
+        Mutating the sequence passed to L{ListenFDs} after construction does not
+        change the descriptors it reports.
+        """
+        descriptors = [7, 8]
+        sddaemon = ListenFDs(descriptors)
+        descriptors.append(9)
+        self.assertEqual([7, 8], list(sddaemon.inheritedDescriptors()))
+
+    def test_rangeNotMaterialized(self):
+        """
+        A C{range} passed to L{ListenFDs} is returned as-is rather than being
+        expanded into one object per descriptor.
+        """
+        descriptors = range(3, 1003)
+        sddaemon = ListenFDs(descriptors)
+        self.assertIs(descriptors, sddaemon.inheritedDescriptors())
+
 
 class EnvironmentTests(EnvironmentMixin, InheritedDescriptorsMixin, TestCase):
     """
@@ -103,8 +145,64 @@ class EnvironmentTests(EnvironmentMixin, InheritedDescriptorsMixin, TestCase):
         fakeEnvironment = self.initializeEnvironment(3, os.getpid())
         first = ListenFDs.fromEnvironment(environ=fakeEnvironment)
         second = ListenFDs.fromEnvironment(environ=fakeEnvironment)
-        self.assertEqual(list(range(3, 6)), first.inheritedDescriptors())
-        self.assertEqual([], second.inheritedDescriptors())
+        self.assertEqual(list(range(3, 6)), list(first.inheritedDescriptors()))
+        self.assertEqual([], list(second.inheritedDescriptors()))
+        self.assertEqual([3, 4, 5], self.madeNonInheritable)
+
+    def test_secondDefaultEnvironment(self):
+        """
+        Only the first L{ListenFDs.fromEnvironment} call using the real process
+        environment extracts inherited file descriptors; the result is not
+        reused by later calls.
+        """
+        self.patch(os, "environ", {"LISTEN_PID": str(os.getpid()), "LISTEN_FDS": "2"})
+        first = ListenFDs.fromEnvironment()
+        second = ListenFDs.fromEnvironment()
+        self.assertEqual([3, 4], list(first.inheritedDescriptors()))
+        self.assertEqual([], list(second.inheritedDescriptors()))
+        self.assertEqual({}, os.environ)
+
+    def test_namesRemoved(self):
+        """
+        Along with I{LISTEN_PID} and I{LISTEN_FDS}, a successful
+        L{ListenFDs.fromEnvironment} removes I{LISTEN_FDNAMES} from the
+        environment.
+        """
+        fakeEnvironment = self.initializeEnvironment(2, os.getpid())
+        fakeEnvironment["LISTEN_FDNAMES"] = "http:https"
+        ListenFDs.fromEnvironment(environ=fakeEnvironment)
+        self.assertNotIn("LISTEN_PID", fakeEnvironment)
+        self.assertNotIn("LISTEN_FDS", fakeEnvironment)
+        self.assertNotIn("LISTEN_FDNAMES", fakeEnvironment)
+
+    def test_closeOnExec(self):
+        """
+        Inherited descriptors are made non-inheritable so that they are not
+        leaked to child processes.
+        """
+        self.patch(systemd, "set_inheritable", os.set_inheritable)
+        r, w = os.pipe()
+        self.addCleanup(os.close, r)
+        self.addCleanup(os.close, w)
+        os.set_inheritable(r, True)
+        fakeEnvironment = self.initializeEnvironment(1, os.getpid())
+        sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment, start=r)
+        self.assertEqual([r], list(sddaemon.inheritedDescriptors()))
+        self.assertFalse(os.get_inheritable(r))
+
+    def test_closeOnExecBadDescriptor(self):
+        """
+        A descriptor which is not actually open is still reported, without
+        raising an error.
+        """
+
+        def setInheritable(fd, inheritable):
+            raise OSError(errno.EBADF, os.strerror(errno.EBADF))
+
+        self.patch(systemd, "set_inheritable", setInheritable)
+        fakeEnvironment = self.initializeEnvironment(1, os.getpid())
+        sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment, start=7)
+        self.assertEqual([7], list(sddaemon.inheritedDescriptors()))
 
     def test_mismatchedPID(self):
         """
@@ -113,7 +211,46 @@ class EnvironmentTests(EnvironmentMixin, InheritedDescriptorsMixin, TestCase):
         """
         fakeEnvironment = self.initializeEnvironment(3, os.getpid() + 1)
         sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
-        self.assertEqual([], sddaemon.inheritedDescriptors())
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
+
+    def test_forkedChild(self):
+        """
+        After a fork, the child compares I{LISTEN_PID} against its own PID
+        rather than the one cached by its parent.
+        """
+        parentPID = os.getpid()
+        self.addCleanup(systemd._refreshPID)
+        self.patch(systemd, "getpid", lambda: parentPID + 1)
+        systemd._refreshPID()
+
+        fakeEnvironment = self.initializeEnvironment(3, parentPID)
+        sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
+
+        fakeEnvironment = self.initializeEnvironment(3, parentPID + 1)
+        sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
+        self.assertEqual([3, 4, 5], list(sddaemon.inheritedDescriptors()))
+
+    @skipIf(not hasattr(os, "register_at_fork"), "os.register_at_fork is not available")
+    def test_realForkRefreshesPID(self):
+        """
+        In a child created by C{os.fork}, the cached PID is the child's own PID.
+        """
+        readFD, writeFD = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(readFD)
+                os.write(writeFD, b"1" if systemd._ownPID == os.getpid() else b"0")
+            finally:
+                os._exit(0)
+        os.close(writeFD)
+        try:
+            result = os.read(readFD, 1)
+        finally:
+            os.close(readFD)
+            os.waitpid(pid, 0)
+        self.assertEqual(b"1", result)
 
     def test_missingPIDVariable(self):
         """
@@ -123,7 +260,7 @@ class EnvironmentTests(EnvironmentMixin, InheritedDescriptorsMixin, TestCase):
         fakeEnvironment = self.initializeEnvironment(3, os.getpid())
         del fakeEnvironment["LISTEN_PID"]
         sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
-        self.assertEqual([], sddaemon.inheritedDescriptors())
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
 
     def test_nonIntegerPIDVariable(self):
         """
@@ -132,7 +269,7 @@ class EnvironmentTests(EnvironmentMixin, InheritedDescriptorsMixin, TestCase):
         """
         fakeEnvironment = self.initializeEnvironment(3, "hello, world")
         sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
-        self.assertEqual([], sddaemon.inheritedDescriptors())
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
 
     def test_missingFDSVariable(self):
         """
@@ -142,7 +279,7 @@ class EnvironmentTests(EnvironmentMixin, InheritedDescriptorsMixin, TestCase):
         fakeEnvironment = self.initializeEnvironment(3, os.getpid())
         del fakeEnvironment["LISTEN_FDS"]
         sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
-        self.assertEqual([], sddaemon.inheritedDescriptors())
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
 
     def test_nonIntegerFDSVariable(self):
         """
@@ -151,7 +288,64 @@ class EnvironmentTests(EnvironmentMixin, InheritedDescriptorsMixin, TestCase):
         """
         fakeEnvironment = self.initializeEnvironment("hello, world", os.getpid())
         sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
-        self.assertEqual([], sddaemon.inheritedDescriptors())
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
+
+    def test_negativeFDSVariable(self):
+        """
+        If the I{LISTEN_FDS} environment variable is negative, no inherited
+        descriptors are reported.
+        """
+        fakeEnvironment = self.initializeEnvironment(-1, os.getpid())
+        sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
+
+    def test_tooLargeFDSVariable(self):
+        """
+        If the I{LISTEN_FDS} environment variable is larger than any real
+        service would be passed, it is treated as malformed and no inherited
+        descriptors are reported.
+        """
+        fakeEnvironment = self.initializeEnvironment(
+            systemd._MAX_LISTEN_FDS + 1, os.getpid()
+        )
+        sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
+
+    def test_noDescriptorsShared(self):
+        """
+        When no descriptors were inherited, L{ListenFDs.fromEnvironment} returns
+        the same instance every time rather than allocating a new one.
+        """
+        fakeEnvironment = self.initializeEnvironment(3, os.getpid() + 1)
+        first = ListenFDs.fromEnvironment(environ=fakeEnvironment)
+        second = ListenFDs.fromEnvironment(environ={})
+        self.assertIs(first, second)
+
+    def test_zeroDescriptorsShared(self):
+        """
+        When I{LISTEN_FDS} is C{0}, L{ListenFDs.fromEnvironment} returns the
+        same shared empty instance as when nothing was inherited, and still
+        removes the systemd variables from the environment.
+        """
+        fakeEnvironment = self.initializeEnvironment(0, os.getpid())
+        sddaemon = ListenFDs.fromEnvironment(environ=fakeEnvironment)
+        self.assertIs(ListenFDs.fromEnvironment(environ={}), sddaemon)
+        self.assertNotIn("LISTEN_PID", fakeEnvironment)
+        self.assertNotIn("LISTEN_FDS", fakeEnvironment)
+
+    def test_noDescriptorsSubclass(self):
+        """
+        When called on a subclass of L{ListenFDs}, L{ListenFDs.fromEnvironment}
+        returns an instance of that subclass even if no descriptors were
+        inherited.
+        """
+
+        class SubListenFDs(ListenFDs):
+            pass
+
+        sddaemon = SubListenFDs.fromEnvironment(environ={})
+        self.assertIsInstance(sddaemon, SubListenFDs)
+        self.assertEqual([], list(sddaemon.inheritedDescriptors()))
 
     def test_defaultEnviron(self):
         """
@@ -161,4 +355,4 @@ class EnvironmentTests(EnvironmentMixin, InheritedDescriptorsMixin, TestCase):
         """
         self.patch(os, "environ", {"LISTEN_PID": str(os.getpid()), "LISTEN_FDS": "5"})
         sddaemon = ListenFDs.fromEnvironment()
-        self.assertEqual(list(range(3, 3 + 5)), sddaemon.inheritedDescriptors())
+        self.assertEqual(list(range(3, 3 + 5)), list(sddaemon.inheritedDescriptors()))